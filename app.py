@@ -1,10 +1,41 @@
 import streamlit as st
 import os
-import shutil
-import tempfile
+import io
+import hashlib
 import zipfile 
-
-from pdf_processing_logic import process_single_pdf
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from pdf_processing_logic import convert_pdf_to_csv
+
+# Meldungen der Verarbeitung (pdf_processing_logic) auf der Konsole; ab WARNING, mit LOG_LEVEL=DEBUG z.B. alles.
+# Unbekannte Werte in LOG_LEVEL (z.B. "verbose") fallen auf WARNING zurück.
+log_level = os.environ.get("LOG_LEVEL", "WARNING").upper()
+log_level_known = log_level in logging.getLevelNamesMapping()
+logging.basicConfig(level=log_level if log_level_known else "WARNING",
+                    format="%(levelname)s %(name)s: %(message)s")
+if not log_level_known:
+    logging.getLogger(__name__).warning("Unbekanntes LOG_LEVEL %r, verwende WARNING.", log_level)
+
+@st.cache_resource(show_spinner=False)
+def get_process_pool():
+    """
+    Returns the worker process pool shared by all sessions. Workers are started with "spawn":
+    forking Streamlit's multi-threaded server process could deadlock the child.
+    """
+    return ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"))
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def cached_convert_pdf_to_csv(pdf_bytes, pdf_name, _executor):
+    """
+    Converts one PDF in a worker process of `_executor`. Results are cached on the PDF bytes and name,
+    so re-uploading or re-converting the same files returns the CSVs without parsing them again.
+    """
+    return _executor.submit(convert_pdf_to_csv, pdf_bytes, pdf_name).result()
 
 st.set_page_config(layout="wide")
 st.title("📄 Edeka-Bestellungen Konverter")
@@ -30,66 +61,92 @@ if st.button("**Dateien konvertieren**", key="convert_button"):
     else:
         st.info("Verarbeitung gestartet... Bitte warten Sie. Dies kann je nach Dateigröße und Anzahl etwas dauern.")
 
-        with tempfile.TemporaryDirectory() as temp_root_dir:
-            temp_pdf_input_dir = os.path.join(temp_root_dir, "input_pdfs")
-            temp_csv_output_dir = os.path.join(temp_root_dir, "temp_csvs")
-            final_csv_download_dir = os.path.join(temp_root_dir, "final_csvs")
-
-            os.makedirs(temp_pdf_input_dir, exist_ok=True)
-            os.makedirs(temp_csv_output_dir, exist_ok=True)
-            os.makedirs(final_csv_download_dir, exist_ok=True)
-
-            processed_csv_paths = []
-
+        converted_csvs = []
+
+        # PDFs are independent and parsing is CPU-bound, so convert them in the shared worker process pool.
+        # UploadedFile objects cannot be pickled; the workers get the raw PDF bytes and the file name.
+        # The CSVs come back in memory and go straight into the ZIP.
+        # The cache lookups run in threads (carrying the script context) that wait on the process pool,
+        # so cached files return immediately while the others are still converted in parallel.
+        executor = get_process_pool()
+        max_workers = min(len(uploaded_files), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max_workers, initializer=add_script_run_ctx,
+                                initargs=(None, get_script_run_ctx())) as dispatcher:
+            futures = {}
             for uploaded_file in uploaded_files:
                 st.text(f"Verarbeite: {uploaded_file.name}...")
-                input_pdf_path = os.path.join(temp_pdf_input_dir, uploaded_file.name)
-                with open(input_pdf_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
+                future = dispatcher.submit(
+                    cached_convert_pdf_to_csv, uploaded_file.getvalue(), uploaded_file.name, executor
+                )
+                futures[future] = uploaded_file.name
 
+            for future in as_completed(futures):
+                file_name = futures[future]
                 try:
-                    final_csv_path = process_single_pdf(
-                        input_pdf_path, 
-                        temp_csv_output_dir, 
-                        final_csv_download_dir
-                    )
-                    if final_csv_path:
-                        processed_csv_paths.append(final_csv_path)
-                        st.success(f"'{uploaded_file.name}' erfolgreich konvertiert.")
+                    result = future.result()
+                    if result:
+                        converted_csvs.append(result)
+                        st.success(f"'{file_name}' erfolgreich konvertiert.")
                     else:
-                        st.warning(f"Konnte '{uploaded_file.name}' nicht verarbeiten. Bitte prüfen Sie das Dateiformat.")
+                        st.warning(f"Konnte '{file_name}' nicht verarbeiten. Bitte prüfen Sie das Dateiformat.")
                 except Exception as e:
-                    st.error(f"Ein unerwarteter Fehler ist bei der Verarbeitung von '{uploaded_file.name}' aufgetreten: {e}")
-
-            # --- Prepare and Display ZIP Download for Processed CSVs ---
-            if processed_csv_paths:
-                st.subheader("Ihre konvertierten CSV-Dateien als ZIP-Datei:")
-
-                zip_file_name = "konvertierte_bestellungen.zip"
-                zip_file_path = os.path.join(temp_root_dir, zip_file_name) 
-
-                try:
-                    with zipfile.ZipFile(zip_file_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                        for csv_path in processed_csv_paths:
-                            zipf.write(csv_path, os.path.basename(csv_path))
-
-                    with open(zip_file_path, "rb") as f:
-                        st.download_button(
-                            label="📦 Alle CSVs als ZIP herunterladen",
-                            data=f.read(),
-                            file_name=zip_file_name,
-                            mime="application/zip",
-                            key="download_all_csvs_zip"
-                        )
-                    st.success(f"Alle {len(processed_csv_paths)} CSV-Dateien wurden in '{zip_file_name}' verpackt und stehen zum Download bereit.")
-
-                except Exception as e:
-                    st.error(f"FEHLER beim Erstellen der ZIP-Datei: {e}")
-                    st.error("Es konnten keine Dateien erfolgreich konvertiert werden oder die ZIP-Erstellung schlug fehl. Bitte überprüfen Sie die hochgeladenen PDFs und die Konfiguration.")
-            else:
-                st.warning("Es wurden keine CSV-Dateien generiert oder gefunden.")
-
-        st.info("Alle temporären Dateien wurden bereinigt.") 
+                    if isinstance(e, BrokenProcessPool):
+                        get_process_pool.clear() # Abgestürzter Pool: beim nächsten Klick einen neuen starten
+                    st.error(f"Ein unerwarteter Fehler ist bei der Verarbeitung von '{file_name}' aufgetreten: {e}")
+
+        # Keep the results across reruns (e.g. the one triggered by clicking the download button).
+        # Sorted by file name so the ZIP content and its signature do not depend on completion order.
+        st.session_state["converted_csvs"] = sorted(converted_csvs)
+        if not converted_csvs:
+            st.warning("Es wurden keine CSV-Dateien generiert oder gefunden.")
+
+# --- Prepare and Display ZIP Download for Processed CSVs ---
+@st.fragment
+def show_zip_download(converted_csvs):
+    """
+    Renders the ZIP download. As a fragment, interacting with it (e.g. clicking the download button)
+    only reruns this function instead of the whole script.
+    """
+    st.subheader("Ihre konvertierten CSV-Dateien als ZIP-Datei:")
+
+    zip_file_name = "konvertierte_bestellungen.zip"
+
+    try:
+        # Every interaction reruns the script; only rebuild the ZIP when the converted CSVs actually changed.
+        zip_hash = hashlib.blake2b(digest_size=16)
+        for csv_filename, csv_bytes in converted_csvs:
+            zip_hash.update(csv_filename.encode('utf-8') + b'\0')
+            zip_hash.update(csv_bytes)
+        zip_signature = zip_hash.digest()
+
+        if st.session_state.get("zip_signature") != zip_signature:
+            # Build the archive in memory: no zip file on disk that has to be read back for the download.
+            # Level 1 is plenty for small, highly repetitive CSVs and much cheaper than the default 6.
+            zip_buffer = io.BytesIO()
+            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zipf:
+                for csv_filename, csv_bytes in converted_csvs:
+                    zipf.writestr(csv_filename, csv_bytes)
+            st.session_state["zip_buffer"] = zip_buffer
+            st.session_state["zip_signature"] = zip_signature
+
+        # Pass the bound getvalue as a callable: Streamlit only copies the archive out of the buffer
+        # when the download is actually requested, not on every render of the button.
+        st.download_button(
+            label="📦 Alle CSVs als ZIP herunterladen",
+            data=st.session_state["zip_buffer"].getvalue,
+            file_name=zip_file_name,
+            mime="application/zip",
+            key="download_all_csvs_zip"
+        )
+        st.success(f"Alle {len(converted_csvs)} CSV-Dateien wurden in '{zip_file_name}' verpackt und stehen zum Download bereit.")
+
+    except Exception as e:
+        st.error(f"FEHLER beim Erstellen der ZIP-Datei: {e}")
+        st.error("Es konnten keine Dateien erfolgreich konvertiert werden oder die ZIP-Erstellung schlug fehl. Bitte überprüfen Sie die hochgeladenen PDFs und die Konfiguration.")
+
+converted_csvs = st.session_state.get("converted_csvs")
+if converted_csvs:
+    show_zip_download(converted_csvs)
 
 st.markdown("---")
 st.markdown("Ein Tool bereitgestellt von Simon Murr ;).")
\ No newline at end of file
@@ -1,10 +1,16 @@
 import os
+import io
 import re
-import csv
-import PyPDF2
+import mmap
+import logging
+import operator
+import hashlib
 import pdfplumber
+from pdfplumber.table import TableSettings
+from pdfminer.pdfdocument import PDFPasswordIncorrect
 import unicodedata
-import shutil
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor
 
 # ====================================================================================================
 # PDF Order Processing Logic (Core Module)
@@ -12,6 +18,9 @@ import shutil
 # It's designed to be imported and used by other applications (e.g., a Streamlit frontend).
 # ====================================================================================================
 
+# Meldungen gehen über logging; das Level setzt die aufrufende Anwendung (siehe app.py, Umgebungsvariable LOG_LEVEL).
+log = logging.getLogger(__name__)
+
 # X-coordinates for table column splits (in points from left edge of the page).
 # EDEKA-spezifische vertikale Linien
 EDEKA_VERTICAL_LINES = [11.34, 99.21, 192.75, 272.12, 334.58, 411.02, 623.61, 722.82]
@@ -30,6 +39,15 @@ DOHLE_VERTICAL_LINES = [28.35, 60.94, 216.74, 256.44, 279.11, 328.62, 390.87, 43
 # muss eine DOHLE_BBOX_OTHER_PAGES definiert und die Logik in process_single_pdf angepasst werden.
 DOHLE_BBOX = [28.35, 342.98, 566.93, 810.20]
 
+# pdfplumber table settings per file type, resolved once at import
+_TABLE_SETTINGS_BASE = {
+    "vertical_strategy": "explicit", # Use defined vertical lines for column separation
+    "horizontal_strategy": "text",   # Detect horizontal lines based on text position
+    "min_words_horizontal": 1        # Minimum words to consider a horizontal line
+}
+_EDEKA_TABLE_SETTINGS = TableSettings.resolve({**_TABLE_SETTINGS_BASE, "explicit_vertical_lines": EDEKA_VERTICAL_LINES})
+_DOHLE_TABLE_SETTINGS = TableSettings.resolve({**_TABLE_SETTINGS_BASE, "explicit_vertical_lines": DOHLE_VERTICAL_LINES})
+
 # Mapping of a distinctive keyword from the delivery address to its corresponding market password.
 # The keys in this dictionary must be in ALL CAPS and normalized according to the `clean_text` function
 # (e.g., German umlauts ä, ö, ü replaced by AE, OE, UE; ß replaced by SS).
@@ -46,6 +64,70 @@ MARKET_PASSWORDS = {
     # Fügen Sie hier weitere Dohle-Märkte hinzu, falls nötig
 }
 
+# Table columns holding the article number and the order quantity (EDEKA: 0 and 1, DOHLE: 4 and 7)
+_EDEKA_ARTICLE_COLUMNS = operator.itemgetter(0, 1)
+_DOHLE_ARTICLE_COLUMNS = operator.itemgetter(4, 7)
+
+# CSV line for one article: 15 ';'-separated columns with the article number in column 2 and the
+# order quantity in column 5.
+_ARTICLE_CSV_LINE = ";{};;;{}" + ";" * 10
+
+# Version of the CSV conversion for the on-disk cache of `_convert_pdf_to_csv_cached`.
+# Bei jeder Änderung an der Konvertierungslogik oder am CSV-Format erhöhen, damit alte Einträge nicht mehr treffen.
+_CACHE_FORMAT_VERSION = "1"
+
+# Fingerprint of everything besides the PDF itself that decides the CSV content; it is part of every
+# cache key, so changing a password, a BBox or the column lines never serves a stale cached CSV.
+_CACHE_FINGERPRINT = hashlib.blake2b(repr((
+    _CACHE_FORMAT_VERSION,
+    sorted(MARKET_PASSWORDS.items()),
+    EDEKA_VERTICAL_LINES, EDEKA_BBOX_PAGE1, EDEKA_BBOX_OTHER_PAGES,
+    DOHLE_VERTICAL_LINES, DOHLE_BBOX,
+    sorted(_TABLE_SETTINGS_BASE.items()),
+    _ARTICLE_CSV_LINE,
+)).encode('utf-8'), digest_size=16).digest()
+
+# Header patterns used by `extract_info_from_text`, compiled once at import.
+_EDEKA_BESTELLDATUM_RE = re.compile(r"Bestelldatum:\s*(\d{2}\.\d{2}\.\d{4})")
+_EDEKA_LIEFERDATUM_RE = re.compile(r"Lieferdatum\/-uhrzeit:\s*(\d{2}\.\d{2}\.\d{4})")
+_EDEKA_BESTELLNUMMER_RE = re.compile(r"Bestellnummer:\s*(\d+)")
+_EDEKA_BESTELL_NR_RE = re.compile(r"Bestell-Nr\.:\s*([A-Za-z0-9\s\/]+)")
+# The address block is bounded to 2000 characters: a real address is a few lines, and the bound keeps a
+# PDF without any of the terminating lines from scanning (and backtracking over) the rest of the text.
+_EDEKA_ADDRESS_RE = re.compile(
+    r'LIEFERANSCHRIFT\s*([\s\S]{0,2000}?)(?=\n(?:GLN:|Empf\.:|Ihr Ansprechpartner\/in|RECHNUNGSEMPFÄNGER|$))',
+    re.IGNORECASE
+)
+_DOHLE_BESTELLNUMMER_RE = re.compile(r"Bestellung Nr\.?\s*(\d+)")
+_DOHLE_BESTELLDATUM_RE = re.compile(r"Datum:\s*(\d{2}\.\d{2}\.\d{4})")
+_DOHLE_LIEFERDATUM_RE = re.compile(r"Liefertermin:\s*(\d{2}\.\d{2}\.\d{4})")
+# The market name is matched within one line ([ \t] instead of \s, $ as line end) and bounded to 60 characters,
+# so the lazy match cannot run (and backtrack) across the rest of the text.
+_DOHLE_MARKT_RE = re.compile(r"AEZ Haus \d+\s*([A-Za-zäöüÄÖÜ \t-]{1,60}?)(?=[ \t]+GLN:|$)", re.MULTILINE)
+_MARKT_NUMMER_NAME_RE = re.compile(r"(\d+)\s*(.*)")
+_LAST_WORD_RE = re.compile(r'(\S+)$')
+# Summary rows and irrelevant headers in the article table, checked in one pass over the joined raw row
+# (case-insensitive and with any whitespace between PLAN and MHD, as the raw cells are not normalized).
+_SKIP_ROW_RE = re.compile(r'PLAN\s+MHD|SUMME|GESAMT', re.IGNORECASE)
+# All MARKET_PASSWORDS keys as one alternation, so the address block is scanned in a single pass.
+# Longest keys first, so a key that contains another shorter key wins at the same position.
+_MARKET_KEYWORDS_RE = re.compile(
+    '|'.join(re.escape(key) for key in sorted(MARKET_PASSWORDS, key=len, reverse=True))
+)
+
+# Translation table for `clean_text`: German umlauts and sharp S (both capital and small) as well as the
+# non-breaking space, the characters that actually occur in the order PDFs. Applied in one str.translate pass.
+_GERMAN_CHARS_TABLE = str.maketrans({
+    'Ä': 'AE', 'Ö': 'OE', 'Ü': 'UE',
+    'ä': 'ae', 'ö': 'oe', 'ü': 'ue',
+    'ẞ': 'SS', 'ß': 'ss',
+    '\xa0': ' ',
+})
+
+# Combining diacritical marks (U+0300-U+036F) mapped to None: after NFKD these are the accents of
+# letters like é or ñ, which `clean_text` drops to get the ASCII base letter.
+_COMBINING_MARKS_TABLE = dict.fromkeys(range(0x300, 0x370))
+
 # --- Helper Functions ---
 
 def clean_text(text):
@@ -64,22 +146,61 @@ def clean_text(text):
     """
     if text is None:
         return ""
+    return _clean_text_cached(text)
+
+# Table cells repeat a lot (empty and whitespace-only cells, header labels, units), so the cleaned
+# strings are memoized on the raw cell text.
+@lru_cache(maxsize=8192)
+def _clean_text_cached(text):
+    """
+    Cached implementation of `clean_text` for a non-None string.
+
+    Args:
+        text (str): The input text string.
+
+    Returns:
+        str: The cleaned and normalized text.
+    """
+    # Fast path for the common case of plain ASCII cells (article numbers, quantities, empty cells):
+    # neither the translation nor the Unicode normalization below can change them.
+    if text.isascii():
+        return ' '.join(text.split())
 
     # Explicit replacements for German special characters before general Unicode normalization.
     # This ensures consistent conversion (e.g., ä -> ae) as required for MARKET_PASSWORDS keys.
-    text = text.replace('Ä', 'AE').replace('Ö', 'OE').replace('Ü', 'UE')
-    text = text.replace('ä', 'ae').replace('ö', 'oe').replace('ü', 'ue')
-    text = text.replace('ẞ', 'SS').replace('ß', 'ss') # Handle both capital and small sharp S
+    # Done in a single str.translate pass (see _GERMAN_CHARS_TABLE).
+    text = text.translate(_GERMAN_CHARS_TABLE)
 
     # Normalize Unicode characters (e.g., accented characters) to their base forms
     # and then encode to ASCII, ignoring any characters that cannot be represented.
     # This helps in handling a wide range of character encoding variations from PDFs.
-    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('utf-8')
+    # After the translation above most PDF text is plain ASCII already, for which this is a no-op.
+    # The combining diacritics NFKD splits off are dropped with a translate table; only text that still
+    # contains other non-ASCII characters needs the round trip through the ASCII codec.
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text).translate(_COMBINING_MARKS_TABLE)
+        if not text.isascii():
+            text = text.encode('ascii', 'ignore').decode('ascii')
 
     # Replace multiple whitespace characters (including newlines) with a single space
-    # and remove leading/trailing spaces.
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
+    # and remove leading/trailing spaces. str.split() without arguments splits on the same
+    # whitespace runs as r'\s+' and drops the leading/trailing ones, without the regex engine.
+    return ' '.join(text.split())
+
+def _csv_field(value):
+    """
+    Quotes a value for the ';'-separated CSV the same way csv.writer (QUOTE_MINIMAL) would:
+    only if it contains the delimiter, a quote character or a line break.
+
+    Args:
+        value (str): The field value.
+
+    Returns:
+        str: The value, quoted if necessary.
+    """
+    if ';' in value or '"' in value or '\n' in value or '\r' in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
 
 def extract_info_from_text(text_content, is_dohle=False):
     """
@@ -101,71 +222,66 @@ def extract_info_from_text(text_content, is_dohle=False):
 
     if not is_dohle: # Logik für EDEKA-Bestellungen
         # Extraktion Bestelldatum (EDEKA)
-        match = re.search(r"Bestelldatum:\s*(\d{2}\.\d{2}\.\d{4})", text_content)
+        match = _EDEKA_BESTELLDATUM_RE.search(text_content)
         if match:
             bestelldatum = match.group(1)
 
         # NEUE Extraktion Liefertermin (EDEKA) - Angepasst an "Lieferdatum/-uhrzeit:"
-        match = re.search(r"Lieferdatum\/-uhrzeit:\s*(\d{2}\.\d{2}\.\d{4})", text_content)
+        match = _EDEKA_LIEFERDATUM_RE.search(text_content)
         if match:
             lieferdatum = match.group(1)
         # Hinzugefügte Debug-Ausgabe für EDEKA
-        print(f"DEBUG (extract_info_from_text EDEKA): Extrahiertes Lieferdatum: '{lieferdatum}'", flush=True)
+        log.debug("(extract_info_from_text EDEKA): Extrahiertes Lieferdatum: '%s'", lieferdatum)
 
         # Extraktion Bestellnummer (EDEKA)
-        match = re.search(r"Bestellnummer:\s*(\d+)", text_content)
+        match = _EDEKA_BESTELLNUMMER_RE.search(text_content)
         if match:
             bestellnummer = match.group(1)
         # Zusätzlicher Regex für Bestellnummern wie "L 001/0002"
         if not bestellnummer: # Falls erste Regex nichts findet
-            match = re.search(r"Bestell-Nr\.:\s*([A-Za-z0-9\s\/]+)", text_content)
+            match = _EDEKA_BESTELL_NR_RE.search(text_content)
             if match:
                 bestellnummer = match.group(1).strip()
 
         # Extraktion Markt-Kennwort (EDEKA)
         # Extract the delivery address block for market identification.
         delivery_address_block = ""
-        match_address = re.search(
-            r'LIEFERANSCHRIFT\s*([\s\S]*?)(?=\n(?:GLN:|Empf\.:|Ihr Ansprechpartner\/in|RECHNUNGSEMPFÄNGER|$))',
-            text_content,
-            re.IGNORECASE
-        )
+        match_address = _EDEKA_ADDRESS_RE.search(text_content)
         if match_address:
             delivery_address_block_raw = match_address.group(1)
             # Clean and uppercase the extracted address block for robust keyword matching
             delivery_address_block = clean_text(delivery_address_block_raw).upper()
 
-            # Iterate through defined market passwords to find a matching keyword in the address block
-            for key_fragment, password_value in MARKET_PASSWORDS.items():
-                if key_fragment in delivery_address_block:
-                    markt_kennwort = password_value
-                    break
+            # Find the first defined market keyword in the address block (single pass, see _MARKET_KEYWORDS_RE)
+            match_keyword = _MARKET_KEYWORDS_RE.search(delivery_address_block)
+            if match_keyword:
+                markt_kennwort = MARKET_PASSWORDS[match_keyword.group(0)]
 
     else: # Logik für AEZ (Dohle HIT)-Bestellungen
         # Extraktion Bestellnummer (Dohle HIT)
-        match = re.search(r"Bestellung Nr\.?\s*(\d+)", text_content)
+        match = _DOHLE_BESTELLNUMMER_RE.search(text_content)
         if match:
             bestellnummer = match.group(1)
 
         # Extraktion Bestelldatum (Dohle HIT)
-        match = re.search(r"Datum:\s*(\d{2}\.\d{2}\.\d{4})", text_content)
+        match = _DOHLE_BESTELLDATUM_RE.search(text_content)
         if match:
             bestelldatum = match.group(1)
 
         # Extraktion Liefertermin (Dohle HIT)
-        match = re.search(r"Liefertermin:\s*(\d{2}\.\d{2}\.\d{4})", text_content)
+        match = _DOHLE_LIEFERDATUM_RE.search(text_content)
         if match:
             lieferdatum = match.group(1)
         # Hinzugefügte Debug-Ausgabe für DOHLE
-        print(f"DEBUG (extract_info_from_text DOHLE): Extrahiertes Lieferdatum: '{lieferdatum}'", flush=True)
+        log.debug("(extract_info_from_text DOHLE): Extrahiertes Lieferdatum: '%s'", lieferdatum)
 
         # Extraktion Marktname (Dohle HIT) - wird nicht in CSV ausgegeben, nur zur Erkennung/Info
         # Suchen nach "AEZ Haus XX NAME"
-        match = re.search(r"AEZ Haus \d+\s*([A-Za-zäöüÄÖÜ\s-]+?)(?=\s+GLN:|\n|$)", text_content)
+        match = _DOHLE_MARKT_RE.search(text_content)
         if match:
             markt_name_raw = match.group(1).strip() # Nur den Namensteil nehmen, z.B. "80 Isartal"
             # Versuche, die Nummer und den Namen zu trennen
-            num_match = re.match(r"(\d+)\s*(.*)", markt_name_raw)
+            num_match = _MARKT_NUMMER_NAME_RE.match(markt_name_raw)
             if num_match:
                 market_actual_name = num_match.group(2).strip()
                 markt_name = f"AEZ Haus {market_actual_name}" # Setze den Namen ohne Nummer zurück, z.B. "AEZ Haus Isartal"
@@ -174,7 +290,7 @@ def extract_info_from_text(text_content, is_dohle=False):
 
             # Extrahiere Schlüsselwort aus market_actual_name für die Marktpasswort-Suche
             cleaned_market_name_for_keyword = clean_text(markt_name_raw).upper() # Bereinige nur den erfassten Namensteil
-            market_identifier_match = re.search(r'(\S+)$', cleaned_market_name_for_keyword)
+            market_identifier_match = _LAST_WORD_RE.search(cleaned_market_name_for_keyword)
             if market_identifier_match:
                 extracted_keyword = market_identifier_match.group(1) # Z.B. "ISARTAL"
                 if extracted_keyword in MARKET_PASSWORDS:
@@ -186,210 +302,414 @@ def extract_info_from_text(text_content, is_dohle=False):
 
     return bestellnummer, bestelldatum, lieferdatum, markt_kennwort, markt_name
 
-def process_single_pdf(pdf_input_path, temp_csv_output_dir, final_csv_download_dir):
+def convert_pdf_to_csv(pdf_input, pdf_name=None):
     """
-    Processes a single PDF file:
+    Converts a single PDF order into the CSV format for CSB, entirely in memory:
     1. Extracts full text for header information.
     2. Extracts table data using pdfplumber based on defined bounding boxes and vertical lines.
     3. Filters and processes article data.
-    4. Generates a formatted CSV file.
-    5. Copies the generated CSV to a final directory and deletes the temporary file.
+    4. Generates the formatted CSV content.
 
     Args:
-        pdf_input_path (str): The full path to the input PDF file.
-        temp_csv_output_dir (str): Path to the temporary CSV output directory.
-        final_csv_download_dir (str): Path to the final CSV download directory.
+        pdf_input (str, bytes or file-like): The full path to the input PDF file, the raw PDF bytes,
+            or a binary file object (e.g. io.BytesIO / Streamlit UploadedFile) containing the PDF.
+            Passing bytes or a file object avoids writing the upload to disk just to read it back;
+            bytes are also what worker processes receive, as file objects cannot be pickled.
+        pdf_name (str, optional): Original file name of the PDF. Required when `pdf_input` is not a
+            path; used for DOHLE/AEZ detection, messages and the CSV file name.
 
     Returns:
-        str or None: Path to the generated CSV file on success, None on failure.
+        tuple or None: (csv_filename, csv_bytes) on success, None on failure.
+
+    Raises:
+        ValueError: If `pdf_input` is not a path and no `pdf_name` is given.
     """
-    full_text = ""
-    table_data_raw = []
-    in_data_section = False # Initialisiert, um die "possibly unbound" Warnung zu vermeiden
+    if pdf_name is None:
+        if not isinstance(pdf_input, (str, os.PathLike)):
+            raise ValueError("pdf_name is required for non-path input")
+        pdf_name = os.path.basename(pdf_input)
 
-    # Attempt to extract full text from the PDF using PyPDF2
+    if isinstance(pdf_input, (bytes, bytearray, memoryview)):
+        pdf_input = io.BytesIO(pdf_input)
+
+    if not isinstance(pdf_input, (str, os.PathLike)):
+        return _convert_pdf_stream(pdf_input, pdf_name)
+
+    # PDFs on disk are memory-mapped: pdfplumber seeks all over the file (xref table, object
+    # streams), and reading from the mapping avoids copying each range through buffered file reads.
     try:
-        with open(pdf_input_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            if reader.is_encrypted:
-                print(f"WARNUNG: PDF ist verschlüsselt und kann nicht gelesen werden: {os.path.basename(pdf_input_path)}")
-                return None
-            for page_num in range(len(reader.pages)):
-                full_text += reader.pages[page_num].extract_text() or ""
+        pdf_file = open(pdf_input, 'rb')
+    except OSError as e:
+        log.error("FEHLER beim Lesen des PDF-Textes von %s: %s", pdf_name, e)
+        return None
+
+    with pdf_file:
+        if os.fstat(pdf_file.fileno()).st_size == 0:
+            # Empty files cannot be mapped; let the parsers report the broken PDF as usual.
+            return _convert_pdf_stream(pdf_file, pdf_name)
+        with mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ) as pdf_map:
+            return _convert_pdf_stream(pdf_map, pdf_name)
+
+def _extract_page_tables(page, bbox, table_settings):
+    """
+    Extracts the article tables of a single PDF page within the given bounding box.
+
+    Args:
+        page (pdfplumber.page.Page): The page to extract the tables from.
+        bbox (list): The bounding box [x0, top, x1, bottom] of the table area on this page.
+        table_settings (pdfplumber.table.TableSettings): The table settings for the file type
+            (`_EDEKA_TABLE_SETTINGS` or `_DOHLE_TABLE_SETTINGS`).
+
+    Returns:
+        list: The tables found on the page, each a list of rows (lists of raw cell strings or None).
+    """
+    return page.crop((bbox[0], bbox[1], bbox[2], bbox[3])).extract_tables(table_settings)
+
+def _convert_pdf_stream(pdf_stream, pdf_name):
+    """
+    Runs the actual conversion for `convert_pdf_to_csv` on an already opened binary stream
+    (file object, BytesIO or mmap). See `convert_pdf_to_csv` for arguments and return value.
+    """
+    # The PDF is parsed only once: the header text and the article tables come from the same
+    # pdfplumber document, whose pages cache their parsed characters for both extractions.
+    try:
+        pdf = pdfplumber.open(pdf_stream)
     except Exception as e:
-        print(f"FEHLER beim Lesen des PDF-Textes von {os.path.basename(pdf_input_path)}: {e}")
+        # Password-protected PDFs fail to open; pdfplumber wraps pdfminer's error without a message
+        if e.args and isinstance(e.args[0], PDFPasswordIncorrect):
+            log.warning("PDF ist verschlüsselt und kann nicht gelesen werden: %s", pdf_name)
+        else:
+            log.error("FEHLER beim Lesen des PDF-Textes von %s: %s", pdf_name, e)
+        return None
+
+    with pdf:
+        return _convert_pdf_document(pdf, pdf_name)
+
+def _convert_pdf_document(pdf, pdf_name):
+    """
+    Converts an opened pdfplumber document. See `convert_pdf_to_csv` for the return value.
+
+    Args:
+        pdf (pdfplumber.PDF): The opened PDF document.
+        pdf_name (str): Original file name of the PDF.
+
+    Returns:
+        tuple or None: (csv_filename, csv_bytes) on success, None on failure.
+    """
+    table_data_raw = []
+    in_data_section = False # Initialisiert, um die "possibly unbound" Warnung zu vermeiden
+
+    # Password-protected PDFs already fail to open (see above); an encryption dictionary means the PDF is encrypted
+    if pdf.doc.encryption is not None:
+        log.warning("PDF ist verschlüsselt und kann nicht gelesen werden: %s", pdf_name)
         return None
 
     # Detect if it's a DOHLEHIT (AEZ) file based on filename
-    file_basename_upper = os.path.basename(pdf_input_path).upper()
+    file_basename_upper = pdf_name.upper()
     is_dohle = "DOHLEHIT" in file_basename_upper or "AEZ" in file_basename_upper
 
-    # Debug-Ausgabe des gesamten extrahierten Textes, falls es ein EDEKA-PDF ist
+    # The header fields are on the first page, so at first only its text is extracted and searched.
+    # Only while a field is still missing, the next page is extracted and searched on its own; the
+    # header is then searched once more in the joined text of all extracted pages.
+    # DOHLE orders do not need the market password, so only date, order number and delivery date count there.
+    required_fields = 3 if is_dohle else 4
+    page_texts = []
+    found_fields = [False] * required_fields
+    header_info = None
+    for page in pdf.pages:
+        try:
+            # use_text_flow keeps the content-stream order (as PyPDF2 did): with the layout order, side-by-side
+            # blocks such as LIEFERANSCHRIFT and RECHNUNGSEMPFÄNGER would be interleaved line by line
+            page_texts.append(page.extract_text(use_text_flow=True) or "")
+        except Exception as e:
+            log.error("FEHLER beim Lesen des PDF-Textes von %s: %s", pdf_name, e)
+            return None
+
+        # Extract header information (date, order number, delivery date, market password, market name)
+        page_info = extract_info_from_text(page_texts[-1], is_dohle=is_dohle)
+        if header_info is None:
+            header_info = page_info
+        found_fields = [found or bool(value) for found, value in zip(found_fields, page_info)]
+        if all(found_fields):
+            break
+
+    full_text = "".join(page_texts)
+    if len(page_texts) != 1: # Mehrere Seiten (oder PDF ohne Seiten): einmal im Gesamttext suchen
+        header_info = extract_info_from_text(full_text, is_dohle=is_dohle)
+
+    bestellnummer, bestelldatum, lieferdatum, markt_kennwort, markt_name = header_info
+
+    # Debug-Ausgabe des Header-Textes (nur die Seiten bis alle Felder gefunden), falls es ein EDEKA-PDF ist
     if not is_dohle:
-        print(f"\n--- DEBUG: Vollständiger extrahierter Text für EDEKA PDF '{os.path.basename(pdf_input_path)}' ---", flush=True)
-        # print(full_text, flush=True) # Diesen print-Befehl auskommentiert, da der Text bereits gepostet wurde
-        print("--- ENDE DEBUG Text --- \n", flush=True)
-
-
-    # Extract header information (date, order number, delivery date, market password, market name)
-    bestellnummer, bestelldatum, lieferdatum, markt_kennwort, markt_name = extract_info_from_text(full_text, is_dohle=is_dohle)
+        log.debug("--- Header-Text für EDEKA PDF '%s' (Seiten bis alle Felder gefunden) ---\n%s\n--- ENDE DEBUG Text ---",
+                  pdf_name, full_text)
 
     # Only EDEKA files require a market password to proceed. Dohle files do not (even if a password is found, it's optional for process continuation).
     if not is_dohle and not markt_kennwort:
-        print(f"WARNUNG: Markt-Kennwort konnte für EDEKA-Bestellung '{os.path.basename(pdf_input_path)}' nicht gefunden werden. Überspringe Datei.")
+        log.warning("Markt-Kennwort konnte für EDEKA-Bestellung '%s' nicht gefunden werden. Überspringe Datei.", pdf_name)
         return None
 
-    # Determine BBOX and vertical lines based on file type
+    # Determine BBOX and table settings (vertical lines) based on file type
     bbox_to_use_page1 = None
     bbox_to_use_other_pages = None
-    vertical_lines_to_use = None
+    table_settings_to_use = None
 
     if is_dohle:
         bbox_to_use_page1 = DOHLE_BBOX
         bbox_to_use_other_pages = DOHLE_BBOX # Aktuell gleiche BBox für alle Seiten bei Dohle HIT
                                              # Bei mehrseitigen DohleHITs muss DOHLE_BBOX_OTHER_PAGES hierher
-        vertical_lines_to_use = DOHLE_VERTICAL_LINES
+        table_settings_to_use = _DOHLE_TABLE_SETTINGS
     else: # Wenn nicht Dohle, dann EDEKA
         bbox_to_use_page1 = EDEKA_BBOX_PAGE1
         bbox_to_use_other_pages = EDEKA_BBOX_OTHER_PAGES
-        vertical_lines_to_use = EDEKA_VERTICAL_LINES
+        table_settings_to_use = _EDEKA_TABLE_SETTINGS
 
     # Extract table data using pdfplumber for both EDEKA and Dohle files
     try:
-        with pdfplumber.open(pdf_input_path) as pdf:
-            for page in pdf.pages:
-                current_bbox = bbox_to_use_page1 if page.page_number == 1 else bbox_to_use_other_pages
-
-                # Sicherheitsprüfung für definierte BBoxes/Linien
-                if current_bbox is None or vertical_lines_to_use is None:
-                    print(f"FEHLER: Bounding Box oder vertikale Linien nicht für den Dateityp '{os.path.basename(pdf_input_path)}' definiert. Überspringe Datei.")
-                    return None
-
-                tables = page.crop((current_bbox[0], current_bbox[1], current_bbox[2], current_bbox[3])).extract_tables({
-                    "vertical_strategy": "explicit", # Use defined vertical lines for column separation
-                    "horizontal_strategy": "text",   # Detect horizontal lines based on text position
-                    "explicit_vertical_lines": vertical_lines_to_use,
-                    "min_words_horizontal": 1        # Minimum words to consider a horizontal line
-                })
-                for table in tables:
-                    for row in table:
-                        # Clean each cell's text upon extraction
-                        table_data_raw.append([clean_text(cell) for cell in row])
+        for page in pdf.pages:
+            current_bbox = bbox_to_use_page1 if page.page_number == 1 else bbox_to_use_other_pages
+
+            # Sicherheitsprüfung für definierte BBoxes/Linien
+            if current_bbox is None or table_settings_to_use is None:
+                log.error("Bounding Box oder vertikale Linien nicht für den Dateityp '%s' definiert. Überspringe Datei.", pdf_name)
+                return None
+
+            # Pages are extracted one after another: all pages of a pdfplumber document read from the
+            # same underlying stream, and the app already converts several PDFs in parallel processes.
+            tables = _extract_page_tables(page, current_bbox, table_settings_to_use)
+            for table in tables:
+                # Rows whose cells are all None or blank are skipped. Cells stay raw (str or None);
+                # only the cells that are actually used get cleaned below
+                table_data_raw.extend(row for row in table if any(cell and not cell.isspace() for cell in row))
 
     except Exception as e:
-        print(f"FEHLER beim Extrahieren der Tabellen von {os.path.basename(pdf_input_path)}: {e}")
+        log.error("FEHLER beim Extrahieren der Tabellen von %s: %s", pdf_name, e)
         return None
 
     if not table_data_raw: # Wenn keine Tabellendaten gefunden wurden
-        print(f"WARNUNG: Keine passende Artikeltabelle in {os.path.basename(pdf_input_path)} gefunden. Prüfen Sie 'vertical_lines' oder 'BBOX_PAGE1'/'BBOX_OTHER_PAGES' und das PDF-Layout.")
+        log.warning("Keine passende Artikeltabelle in %s gefunden. Prüfen Sie 'vertical_lines' oder 'BBOX_PAGE1'/'BBOX_OTHER_PAGES' und das PDF-Layout.", pdf_name)
         return None
 
-    # Process and filter extracted article data (relevant for EDEKA and Dohle HIT)
-    processed_article_data = []
+    # --- CSV Generation ---
+    # The header lines are written first; the filter loop below appends the article lines directly.
+    output_filename = os.path.splitext(pdf_name)[0] + ".csv"
 
-    for i, row in enumerate(table_data_raw):
-        row_joined_upper = " ".join(row).upper()
+    # The lines are joined by hand: all fields are plain text, only the header values get the
+    # csv.writer-style quoting check (see `_csv_field`).
+    csv_lines = []
 
-        # Skip empty rows
-        if not any(cell.strip() for cell in row):
-            continue
+    # Write header row (e.g., with market password in column 15 for EDEKA/empty for Dohle)
+    header_row_csv = [''] * 15
+    # Platzierung des Markt-Kennworts (für EDEKA) oder leer (für Dohle HIT) in Spalte O1 (Index 14)
+    header_row_csv[14] = _csv_field(markt_kennwort)
+    csv_lines.append(";".join(header_row_csv))
 
-        if not is_dohle: # EDEKA-specific logic for detecting data section start
-            # Detect the start of the data section (e.g., a row with all underscores)
-            if all(cell.strip().startswith('_') for cell in row if cell.strip()):
-                in_data_section = True
-                continue
+    # Write empty row (as per desired CSV format)
+    csv_lines.append(";".join([''] * 15))
+
+    # Write Bestelldatum in column 3
+    row_c3 = [''] * 15
+    row_c3[2] = _csv_field(bestelldatum)
+    csv_lines.append(";".join(row_c3))
+
+    # Write Bestellnummer in column 3
+    row_c4 = [''] * 15
+    row_c4[2] = _csv_field(bestellnummer)
+    csv_lines.append(";".join(row_c4))
+
+    # Write Lieferdatum in column 3
+    row_c5 = [''] * 15
+    row_c5[2] = _csv_field(lieferdatum) # Hier wird das Lieferdatum in die CSV-Zeile eingefügt
+    csv_lines.append(";".join(row_c5))
+
+    # Process and filter extracted article data (relevant for EDEKA and Dohle HIT)
+    header_line_count = len(csv_lines)
+
+    # Column indices for article number and order quantity differ between EDEKA and DOHLE
+    get_article_columns = _DOHLE_ARTICLE_COLUMNS if is_dohle else _EDEKA_ARTICLE_COLUMNS
 
-            # Only process rows if we are past the initial headers and in the data section for EDEKA
+    for i, row in enumerate(table_data_raw):
+        if not is_dohle: # EDEKA-specific logic for detecting data section start
+            # Only process rows if we are past the initial headers and in the data section for EDEKA.
+            # Detect the start of the data section (e.g., a row with all underscores). Inside the data
+            # section such rows need no check, they never pass the article number validation below.
             if not in_data_section:
+                # Needs at least one populated cell after cleaning: rows whose content cleans away entirely
+                # (e.g. "€", "•") count as empty. all() stops at the first populated cell that
+                # is not underscores (the usual header row).
+                cleaned_cells = (cell for cell in map(clean_text, row) if cell)
+                first_cell = next(cleaned_cells, None)
+                if first_cell is not None and first_cell.startswith('_') and all(cell.startswith('_') for cell in cleaned_cells):
+                    in_data_section = True
                 continue
 
-        # Skip summary rows or irrelevant headers (applies to both EDEKA and Dohle)
-        if "PLAN MHD" in row_joined_upper or "SUMME" in row_joined_upper or "GESAMT" in row_joined_upper:
+        # Article number and order quantity in one call; a row too short to have both columns
+        # could never yield a valid article
+        try:
+            lief_artnr_raw, bestellmenge_raw = get_article_columns(row)
+        except IndexError:
             continue
+        # ASCII cells only need stripping: clean_text would additionally collapse inner whitespace, but a
+        # cell with inner whitespace is rejected by isdigit()/float() below either way.
+        lief_artnr_str = lief_artnr_raw.strip() if lief_artnr_raw and lief_artnr_raw.isascii() else clean_text(lief_artnr_raw)
 
-        # Column indices for article number and order quantity differ between EDEKA and DOHLE
-        if is_dohle:
-            lief_artnr_str = row[4] if len(row) > 4 else ""
-            bestellmenge_str = row[7] if len(row) > 7 else ""
-        else: # EDEKA Spalten
-            lief_artnr_str = row[0] if len(row) > 0 else ""
-            bestellmenge_str = row[1] if len(row) > 1 else ""
-
-        current_lief_artnr = ""
-        # Validate that the article number is numeric
-        if lief_artnr_str.strip().isdigit():
-            current_lief_artnr = lief_artnr_str.strip()
-        else:
+        # Validate that the article number is numeric. The cell is stripped and ASCII at this point,
+        # so isdigit() only accepts 0-9 here and no second strip is needed.
+        if not lief_artnr_str.isdigit():
             continue
+        current_lief_artnr = lief_artnr_str
+
+        # Skip summary rows or irrelevant headers (applies to both EDEKA and Dohle). Checked only now,
+        # as the cheap article number test above already rejects most of these rows without a join.
+        if _SKIP_ROW_RE.search(" ".join(cell for cell in row if cell)):
+            continue
+
+        bestellmenge_str = bestellmenge_raw.strip() if bestellmenge_raw and bestellmenge_raw.isascii() else clean_text(bestellmenge_raw)
 
         try:
             # Convert order quantity to float, handling comma as decimal separator
-            bestellmenge = float(bestellmenge_str.replace(',', '.').strip())
-
-            # Add valid article data to the list.
+            # (the cell is already stripped; whole numbers need no replacement at all)
+            if ',' in bestellmenge_str:
+                bestellmenge_str = bestellmenge_str.replace(',', '.')
+            bestellmenge = float(bestellmenge_str)
+
+            # Write the CSV line of a valid article, with the quantity formatted with a decimal comma.
+            # The quantity keeps the float round trip, CSB expects its format (e.g. "3" -> "3,0").
+            # Article numbers are digits and quantities numbers, so these never need quoting.
             if bestelldatum and bestellnummer and current_lief_artnr and bestellmenge > 0:
-                processed_article_data.append({
-                    "artikelnummer": current_lief_artnr,
-                    "bestellmenge": bestellmenge
-                })
+                csv_lines.append(_ARTICLE_CSV_LINE.format(current_lief_artnr, str(bestellmenge).replace('.', ',')))
         except (ValueError, IndexError):
             continue
 
-    if not processed_article_data:
-        print(f"WARNUNG: Nach Filterung keine gültigen Artikeldaten für {os.path.basename(pdf_input_path)} gefunden.")
+    if len(csv_lines) == header_line_count: # Keine Artikelzeilen hinzugefügt
+        log.warning("Nach Filterung keine gültigen Artikeldaten für %s gefunden.", pdf_name)
         return None
 
-    # --- CSV File Generation ---
-    output_filename = os.path.splitext(os.path.basename(pdf_input_path))[0] + ".csv"
-    temp_csv_path = os.path.join(temp_csv_output_dir, output_filename)
-    final_csv_path = os.path.join(final_csv_download_dir, output_filename)
+    # Same line terminator as csv.writer, including after the last row
+    csv_lines.append("")
+    return output_filename, "\r\n".join(csv_lines).encode('ISO-8859-1')
 
-    with open(temp_csv_path, 'w', newline='', encoding='ISO-8859-1') as csvfile:
-        csv_writer = csv.writer(csvfile, delimiter=';')
-
-        # Write header row (e.g., with market password in column 15 for EDEKA/empty for Dohle)
-        header_row_csv = [''] * 15
-        # Platzierung des Markt-Kennworts (für EDEKA) oder leer (für Dohle HIT) in Spalte O1 (Index 14)
-        header_row_csv[14] = markt_kennwort
-        csv_writer.writerow(header_row_csv)
-
-        # Write empty row (as per desired CSV format)
-        csv_writer.writerow([''] * 15)
-
-        # Write Bestelldatum in column 3
-        row_c3 = [''] * 15
-        row_c3[2] = bestelldatum
-        csv_writer.writerow(row_c3)
-
-        # Write Bestellnummer in column 3
-        row_c4 = [''] * 15
-        row_c4[2] = bestellnummer
-        csv_writer.writerow(row_c4)
-
-        # Write Lieferdatum in column 3
-        row_c5 = [''] * 15
-        row_c5[2] = lieferdatum # Hier wird das Lieferdatum in die CSV-Zeile eingefügt
-        csv_writer.writerow(row_c5)
-
-        # Write article data rows (only if processed_article_data is not empty)
-        for item in processed_article_data:
-            row_csv = [''] * 15
-            row_csv[1] = item["artikelnummer"]
-            row_csv[4] = str(item["bestellmenge"]).replace('.', ',') # Format quantity with comma for CSV
-            csv_writer.writerow(row_csv)
-
-    # Copy the temporary CSV to the final download directory
-    try:
-        shutil.copy(temp_csv_path, final_csv_path)
-        print(f"CSV-Datei erfolgreich erstellt und kopiert nach: {final_csv_path}")
+def _convert_pdf_to_csv_cached(pdf_input, pdf_name, cache_dir):
+    """
+    `convert_pdf_to_csv` with an on-disk cache: the CSV of every converted PDF is stored in `cache_dir`
+    under a BLAKE2b hash of the PDF content and file name (the name decides between EDEKA and DOHLE),
+    so the same PDF is parsed only once, however often it is processed. The key also covers
+    `_CACHE_FINGERPRINT` (passwords, BBoxes, column lines, format version), so a changed
+    configuration never returns a stale CSV. Entries are never evicted: the directory keeps growing
+    until it is cleaned up by the caller.
 
-        # Delete the temporary CSV file after successful copy
-        os.remove(temp_csv_path)
-        print(f"Temporäre Datei '{os.path.basename(temp_csv_path)}' gelöscht.")
+    Args:
+        pdf_input (str, bytes or file-like): The PDF to convert, see `convert_pdf_to_csv`.
+        pdf_name (str, optional): Original file name of the PDF, see `convert_pdf_to_csv`.
+        cache_dir (str): Directory holding the cached CSV files; created if necessary.
+
+    Returns:
+        tuple or None: (csv_filename, csv_bytes) on success, None on failure.
 
+    Raises:
+        ValueError: If `pdf_input` is not a path and no `pdf_name` is given.
+    """
+    if pdf_name is None:
+        if not isinstance(pdf_input, (str, os.PathLike)):
+            raise ValueError("pdf_name is required for non-path input")
+        pdf_name = os.path.basename(pdf_input)
+
+    # The content is needed for the hash anyway, so read it once and convert from memory
+    if isinstance(pdf_input, (str, os.PathLike)):
+        try:
+            with open(pdf_input, 'rb') as pdf_file:
+                pdf_input = pdf_file.read()
+        except OSError as e:
+            log.error("FEHLER beim Lesen des PDF-Textes von %s: %s", pdf_name, e)
+            return None
+    elif not isinstance(pdf_input, (bytes, bytearray, memoryview)):
+        pdf_input = pdf_input.read()
+
+    cache_hash = hashlib.blake2b(_CACHE_FINGERPRINT, digest_size=16)
+    cache_hash.update(pdf_name.encode('utf-8') + b'\0')
+    cache_hash.update(pdf_input)
+    cache_path = os.path.join(cache_dir, cache_hash.hexdigest() + ".csv")
+
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as cached_file:
+            return os.path.splitext(pdf_name)[0] + ".csv", cached_file.read()
+
+    result = convert_pdf_to_csv(pdf_input, pdf_name)
+    if result is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Written under a per-process name and renamed, so parallel workers never read a partial file
+            partial_path = f"{cache_path}.{os.getpid()}.part"
+            with open(partial_path, 'wb') as cached_file:
+                cached_file.write(result[1])
+            os.replace(partial_path, cache_path)
+        except OSError as e:
+            log.warning("CSV konnte nicht im Cache gespeichert werden (%s): %s", cache_path, e)
+    return result
+
+def process_single_pdf(pdf_input, temp_csv_output_dir, final_csv_download_dir, pdf_name=None, cache_dir=None):
+    """
+    Processes a single PDF file:
+    1. Converts the PDF to CSV content via `convert_pdf_to_csv` (or takes it from the cache).
+    2. Writes the CSV file once, directly into the final directory (atomically via a ".part" file).
+
+    Args:
+        pdf_input (str, bytes or file-like): The PDF to convert, see `convert_pdf_to_csv`.
+        temp_csv_output_dir (str): Unused; kept so existing callers keep working.
+        final_csv_download_dir (str): Path to the final CSV download directory.
+        pdf_name (str, optional): Original file name of the PDF, see `convert_pdf_to_csv`.
+        cache_dir (str, optional): Directory for caching the CSVs by PDF content, so duplicate PDFs
+            are only converted once. No caching if not given.
+
+    Returns:
+        str or None: Path to the generated CSV file on success, None on failure.
+    """
+    if cache_dir is not None:
+        result = _convert_pdf_to_csv_cached(pdf_input, pdf_name, cache_dir)
+    else:
+        result = convert_pdf_to_csv(pdf_input, pdf_name)
+    if result is None:
+        return None
+    output_filename, csv_bytes = result
+
+    final_csv_path = os.path.join(final_csv_download_dir, output_filename)
+
+    # The CSV content is complete in memory and is written next to its destination as a ".part"
+    # file, then renamed in one step, so nobody ever sees a half-written CSV.
+    partial_csv_path = f"{final_csv_path}.{os.getpid()}.part"
+    try:
+        with open(partial_csv_path, 'wb') as csvfile:
+            csvfile.write(csv_bytes)
+        os.replace(partial_csv_path, final_csv_path)
+        log.info("CSV-Datei erfolgreich erstellt: %s", final_csv_path)
         return final_csv_path # Return the path to the successfully created CSV
 
     except Exception as e:
-        print(f"FEHLER beim Kopieren oder Löschen der CSV-Datei: {e}")
-        return None
\ No newline at end of file
+        log.error("FEHLER beim Schreiben der CSV-Datei: %s", e)
+        if os.path.exists(partial_csv_path):
+            os.remove(partial_csv_path)
+        return None
+
+def process_many_pdfs(pdf_paths, temp_csv_output_dir, final_csv_download_dir, max_workers=None, cache_dir=None):
+    """
+    Processes several PDF files in parallel worker processes, see `process_single_pdf`.
+    PDF parsing is CPU-bound pure Python, so processes (not threads) are needed to use all cores.
+
+    Args:
+        pdf_paths (list): Paths to the input PDF files.
+        temp_csv_output_dir (str): Unused; kept so existing callers keep working
+            (see `process_single_pdf`).
+        final_csv_download_dir (str): Path to the final CSV download directory.
+        max_workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        cache_dir (str, optional): CSV cache directory, see `process_single_pdf`.
+
+    Returns:
+        list: For each input PDF (in the same order) the path to the generated CSV file, or None on failure.
+    """
+    if not pdf_paths:
+        return []
+
+    convert = partial(process_single_pdf, temp_csv_output_dir=temp_csv_output_dir,
+                      final_csv_download_dir=final_csv_download_dir, cache_dir=cache_dir)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(convert, pdf_paths))